@@ -6,22 +6,47 @@ Autor: Samuel Pires
 Funcionalidades:
 - Leitura de extratos bancarios (CSV)
 - Categorizacao automatica via IA (Regras de Negocio)
-- Deteccao de duplicatas (Hash MD5)
+- Deteccao de duplicatas (Hash BLAKE3, reconhecendo o historico MD5 antigo)
 - Integracao via API Google Sheets
 - Sistema de Logs e Auditoria
 """
 
 import pandas as pd
+import numpy as np
 import gspread
+import blake3
 from oauth2client.service_account import ServiceAccountCredentials
-from gspread_dataframe import get_as_dataframe
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import re
+import codecs
 import hashlib
+import pickle
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from logging.handlers import RotatingFileHandler
 
+try:
+    import ahocorasick
+except ImportError:  # Dependencia opcional: sem ela a categorizacao usa busca linear
+    ahocorasick = None
+
+try:
+    import pyarrow
+except ImportError:  # Dependencia opcional: sem ela os CSVs sao lidos com o engine C do pandas
+    pyarrow = None
+
+try:
+    import charset_normalizer
+except ImportError:  # Dependencia opcional: sem ela arquivos que nao sao UTF-8 sao lidos como latin1
+    charset_normalizer = None
+
+try:
+    from pybloom_live import BloomFilter
+except ImportError:  # Dependencia opcional: sem ela o historico de hashes fica sempre em um frozenset
+    BloomFilter = None
+
 # ==============================================================================
 # CONFIGURACAO DE LOGGING
 # ==============================================================================
@@ -31,7 +56,11 @@ def configurar_logging():
     log_filename = f'logs/financas_automacao_{datetime.now().strftime("%Y%m")}.log'
     
     logger = logging.getLogger('FinancasBob')
-    logger.setLevel(logging.DEBUG)
+    # INFO por padrao; use FINANCAS_LOG_LEVEL=DEBUG para o log detalhado
+    nivel = getattr(logging, os.environ.get('FINANCAS_LOG_LEVEL', 'INFO').upper(), None)
+    if not isinstance(nivel, int) or isinstance(nivel, bool):
+        nivel = logging.INFO
+    logger.setLevel(nivel)
     logger.handlers.clear()
     
     formato = logging.Formatter(
@@ -95,6 +124,13 @@ class Config:
     
     PASTA_EXTRATOS = 'extratos'
     PASTA_PROCESSADOS = 'extratos/processados'
+    
+    # Cache local dos hashes do historico (Bloom filter), usado quando o historico e grande.
+    # Importacoes feitas em outra maquina so sao vistas depois que o cache expira.
+    ARQUIVO_CACHE_HASHES = 'cache/hashes.bloom'
+    CACHE_HASHES_VALIDADE_DIAS = 7
+    BLOOM_MIN_HISTORICO = 10_000
+    BLOOM_TAXA_ERRO = 1e-6
 
 # ==============================================================================
 # ENGINE DE CATEGORIZACAO
@@ -121,28 +157,77 @@ class CategorizadorIA:
         'tim', 'vivo', 'claro', 'oi', 'netflix', 'spotify', 'prime', 'disney',
         'faculdade', 'universidade', 'mensalidade', 'plano', 'assinatura', 'academia'
     ]
+    # Palavras ja sem espacos/pontos/hifens, comparadas contra a descricao limpa
+    GASTOS_FIXOS_LIMPOS = [p.replace(' ', '').replace('.', '').replace('-', '') for p in GASTOS_FIXOS_KEYWORDS]
+    _REGEX_FIXOS = re.compile('|'.join(map(re.escape, GASTOS_FIXOS_LIMPOS)))
+    # Uma alternancia compilada por categoria, usada quando o pyahocorasick nao esta instalado
+    _REGEX_CATEGORIAS = [(categoria, re.compile('|'.join(map(re.escape, palavras)))) for categoria, palavras in MAPEAMENTO.items()]
+    
+    _automato = None
+    
+    @classmethod
+    def _construir_automato(cls):
+        # Automato Aho-Corasick das categorias (construido uma vez e reaproveitado pela classe)
+        if cls._automato is None:
+            categorias = ahocorasick.Automaton()
+            for prioridade, (categoria, palavras) in enumerate(cls.MAPEAMENTO.items()):
+                for palavra in palavras:
+                    atual = categorias.get(palavra, None)
+                    if atual is None or prioridade < atual[0]:
+                        categorias.add_word(palavra, (prioridade, categoria))
+            categorias.make_automaton()
+            cls._automato = categorias
+        return cls._automato
     
     @classmethod
     def categorizar(cls, descricao, valor):
         desc = descricao.lower()
-        logger.debug(f"Categorizando: '{descricao[:50]}...' | Valor: R$ {valor}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Categorizando: '{descricao[:50]}...' | Valor: R$ {valor}")
         
         if valor > 0 or 'recebida' in desc or 'salario' in desc:
             return 'Entrada', 'Receita', False
         
         desc_limpo = desc.replace(' ', '').replace('.', '').replace('-', '')
-        eh_fixo = False
-        for palavra in cls.GASTOS_FIXOS_KEYWORDS:
-            palavra_limpa = palavra.replace(' ', '').replace('.', '').replace('-', '')
-            if palavra_limpa in desc_limpo:
-                eh_fixo = True
-                break
-        
-        for categoria, palavras in cls.MAPEAMENTO.items():
-            if any(palavra in desc for palavra in palavras):
-                return categoria, 'Despesa', eh_fixo
+        return cls._categoria_despesa(desc), 'Despesa', cls._eh_fixo(desc_limpo)
+    
+    @classmethod
+    def categorizar_lote(cls, df, desc=None):
+        # Categoriza todas as transacoes de uma vez: (categorias, tipos, fixos)
+        if desc is None:
+            desc = df['Descricao'].str.lower()
+        receita = ((df['Valor'] > 0) | desc.str.contains('recebida|salario', na=False)).values
+        # Descricoes repetidas (assinaturas, recorrentes) sao categorizadas uma unica vez
+        categorias_unicas = {d: cls._categoria_despesa(d) for d in desc[~receita].unique()}
+        categorias = desc.map(categorias_unicas).where(~receita, 'Entrada').values
+        tipos = np.where(receita, 'Receita', 'Despesa')
+        fixos = cls.identificar_gastos_fixos(df['Descricao']).values & ~receita
+        logger.debug(f"{len(df)} transacoes categorizadas ({receita.sum()} entradas, {fixos.sum()} gastos fixos)")
+        return categorias, tipos, fixos
+    
+    @classmethod
+    def _categoria_despesa(cls, desc):
+        if ahocorasick is not None:
+            categorias = cls._construir_automato()
+            # Vence a categoria que aparece primeiro no MAPEAMENTO, como na busca linear
+            encontrada = min((dados for _, dados in categorias.iter(desc)), default=None)
+            return encontrada[1] if encontrada else 'Necessidade'
         
-        return 'Necessidade', 'Despesa', eh_fixo
+        for categoria, regex in cls._REGEX_CATEGORIAS:
+            if regex.search(desc):
+                return categoria
+        return 'Necessidade'
+    
+    @classmethod
+    def _eh_fixo(cls, desc_limpo):
+        # Mesmo matcher de identificar_gastos_fixos, para as duas versoes darem o mesmo resultado
+        return cls._REGEX_FIXOS.search(desc_limpo) is not None
+    
+    @classmethod
+    def identificar_gastos_fixos(cls, descricoes):
+        # Versao vetorizada da deteccao de gasto fixo para uma coluna inteira
+        desc_limpo = descricoes.str.lower().str.replace(r'[ .\-]', '', regex=True)
+        return desc_limpo.str.contains(cls._REGEX_FIXOS, na=False)
     
     @classmethod
     def identificar_forma_pagamento(cls, descricao):
@@ -150,6 +235,15 @@ class CategorizadorIA:
         if 'pix' in desc: return 'Pix'
         elif 'cartao' in desc or 'credito' in desc: return 'Cartao'
         else: return 'Pix'
+    
+    @classmethod
+    def identificar_formas_pagamento(cls, desc):
+        # Versao vetorizada de identificar_forma_pagamento; recebe as descricoes ja em minusculas
+        return np.select(
+            [desc.str.contains('pix', na=False), desc.str.contains('cartao|credito', na=False)],
+            ['Pix', 'Cartao'],
+            default='Pix'
+        )
 
 # ==============================================================================
 # LEITOR DE EXTRATOS
@@ -158,10 +252,17 @@ class LeitorExtratos:
     @staticmethod
     def ler_csv_nubank_brasil(caminho):
         logger.info(f"Lendo CSV: {caminho}")
+        engine = 'pyarrow' if pyarrow is not None else 'c'
+        opcoes = dict(engine=engine, parse_dates=['Data'], date_format='%d/%m/%Y')
+        encoding = LeitorExtratos._detectar_encoding(caminho)
         try:
-            df = pd.read_csv(caminho, encoding='utf-8')
+            df = pd.read_csv(caminho, encoding=encoding, **opcoes)
         except UnicodeDecodeError:
-            df = pd.read_csv(caminho, encoding='latin1')
+            df = None
+        # Amostra valida no encoding detectado mas o restante do arquivo nao: o engine C gera
+        # UnicodeDecodeError e o pyarrow devolve a coluna como bytes. Nos dois casos le de novo como latin1.
+        if df is None or (encoding != 'latin1' and LeitorExtratos._possui_bytes(df)):
+            df = pd.read_csv(caminho, encoding='latin1', **opcoes)
         
         colunas_requeridas = ['Data', 'Valor']
         # Logica para encontrar a coluna de descricao independente do nome exato
@@ -171,18 +272,58 @@ class LeitorExtratos:
             raise ValueError("CSV invalido: falta coluna de descricao")
         
         df = df.rename(columns={colunas_desc[0]: 'Descricao'})
+        # Sem custo quando o read_csv ja trouxe float/datetime64; so converte arquivos com linhas invalidas
         df['Valor'] = pd.to_numeric(df['Valor'], errors='coerce')
-        df = df.dropna(subset=['Valor'])
-        df['Data'] = pd.to_datetime(df['Data'], format='%d/%m/%Y', errors='coerce').dt.strftime('%d/%m/%Y')
-        df = df.dropna(subset=['Data'])
+        df['Data'] = pd.to_datetime(df['Data'], format='%d/%m/%Y', errors='coerce')
+        df = df.dropna(subset=['Valor', 'Data'])
         
-        return df[['Data', 'Descricao', 'Valor']].copy()
+        return df[['Data', 'Descricao', 'Valor']]
+    
+    @staticmethod
+    def _possui_bytes(df):
+        # O pyarrow converte a coluna inteira para bytes, basta olhar o primeiro valor preenchido
+        for col in df.columns:
+            if df[col].dtype == object:
+                preenchidos = df[col].dropna()
+                if not preenchidos.empty and isinstance(preenchidos.iloc[0], bytes):
+                    return True
+        return False
+    
+    @staticmethod
+    def _detectar_encoding(caminho, tamanho_amostra=32 * 1024):
+        # Detecta o encoding pelo inicio do arquivo, evitando ler o CSV inteiro duas vezes
+        with open(caminho, 'rb') as f:
+            amostra = f.read(tamanho_amostra)
+        
+        if amostra.startswith(codecs.BOM_UTF8): return 'utf-8-sig'
+        if amostra.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)): return 'utf-16'
+        try:
+            # Decoder incremental tolera um caractere multibyte cortado no fim da amostra
+            codecs.getincrementaldecoder('utf-8')().decode(amostra, final=False)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        
+        if charset_normalizer is not None:
+            # Restrito a encodings ocidentais: em amostras pequenas o palpite livre pode cair em big5, gb18030...
+            melhor = charset_normalizer.from_bytes(amostra, cp_isolation=['cp1252', 'latin_1', 'iso8859_15']).best()
+            if melhor is not None: return melhor.encoding
+        return 'latin1'
     
     @staticmethod
     def detectar_e_ler(caminho):
         if Path(caminho).suffix.lower() == '.csv':
             return LeitorExtratos.ler_csv_nubank_brasil(caminho)
         raise ValueError("Formato nao suportado")
+    
+    @staticmethod
+    def ler_ou_ignorar(caminho):
+        # Versao sem excecao de detectar_e_ler, para uso no pool de leitura do main
+        try:
+            return LeitorExtratos.detectar_e_ler(caminho)
+        except Exception as e:
+            logger.warning(f"Arquivo ignorado '{caminho}': {e}")
+            return None
 
 # ==============================================================================
 # INTEGRADOR GOOGLE SHEETS
@@ -197,48 +338,154 @@ class IntegradorSheets:
             self.client = gspread.authorize(creds)
             self.planilha = self.client.open_by_key(Config.PLANILHA_ID)
             self.aba_mes = self.planilha.worksheet(Config.MES_ATUAL)
+            # Uma unica leitura da aba do mes; as secoes livres sao calculadas localmente
+            self._aba_snapshot = self.aba_mes.get_all_values()
+            self._hashes_cache = None
+            self._bloom_criado_em = None
         except Exception as e:
             logger.error(f"Erro de conexao. Verifique Credenciais e ID da Planilha. Detalhes: {e}")
             raise
 
-    def _gerar_hash_transacao(self, row):
-        texto = f"{row['Data']}|{row['Descricao']}|{row['Valor']}"
-        return hashlib.md5(texto.encode()).hexdigest()
+    def _gerar_hashes(self, df, legado=False):
+        # Monta a chave "Data|Descricao|Valor" de forma vetorizada e so depois aplica o hash
+        chaves = (df['Data'].dt.strftime('%d/%m/%Y') + '|' + df['Descricao'].astype(str) + '|' + df['Valor'].astype(str)).values
+        if legado:
+            # MD5: formato do historico gravado antes do BLAKE3, usado so para reconhecer duplicatas
+            return [hashlib.md5(chave.encode('utf-8')).hexdigest() for chave in chaves]
+        # BLAKE3 truncado em 128 bits: mesmo tamanho do MD5 na coluna Hash
+        hashes = [blake3.blake3(chave.encode('utf-8')).hexdigest(length=16) for chave in chaves]
+        if len(set(hashes)) != len(set(chaves)):
+            logger.warning("Colisao de hash detectada no lote importado!")
+        return hashes
     
     def _get_transacoes_existentes(self):
+        # Le apenas a coluna Hash (A) do historico, uma vez por execucao
+        if self._hashes_cache is not None:
+            return self._hashes_cache
+        bloom = self._carregar_cache_bloom()
+        if bloom is not None:
+            try:
+                # O cache nao enxerga alteracoes na planilha: confere (so metadados) se a aba ainda existe
+                self.planilha.worksheet(Config.ABA_HISTORICO)
+                self._hashes_cache = bloom
+                return self._hashes_cache
+            except gspread.exceptions.WorksheetNotFound:
+                logger.warning("Aba de historico nao encontrada, descartando cache local de hashes")
+                os.remove(Config.ARQUIVO_CACHE_HASHES)
+        
         try:
-            aba = self.planilha.worksheet(Config.ABA_HISTORICO)
-            df = get_as_dataframe(aba, evaluate_formulas=True)
-            if 'Hash' not in df.columns: return set()
-            return set(df['Hash'].dropna().tolist())
+            valores = self.planilha.worksheet(Config.ABA_HISTORICO).col_values(1)
+            hashes = [v for v in valores[1:] if v] if valores and valores[0] == 'Hash' else []
         except gspread.exceptions.WorksheetNotFound:
             self._criar_aba_historico()
-            return set()
+            hashes = []
+        
+        if BloomFilter is not None and len(hashes) >= Config.BLOOM_MIN_HISTORICO:
+            # Historico grande: ~4 bytes por hash em vez de uma string por hash em memoria
+            bloom = BloomFilter(capacity=max(10_000, len(hashes) * 2), error_rate=Config.BLOOM_TAXA_ERRO)
+            for h in hashes:
+                bloom.add(h)
+            self._bloom_criado_em = datetime.now()
+            self._salvar_cache_bloom(bloom)
+            self._hashes_cache = bloom
+        else:
+            self._hashes_cache = frozenset(hashes)
+        return self._hashes_cache
+
+    def _carregar_cache_bloom(self):
+        if BloomFilter is None or not os.path.exists(Config.ARQUIVO_CACHE_HASHES):
+            return None
+        try:
+            with open(Config.ARQUIVO_CACHE_HASHES, 'rb') as f:
+                planilha_id, aba_historico, criado_em, bloom = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Cache de hashes invalido, baixando historico: {e}")
+            return None
+        if (planilha_id, aba_historico) != (Config.PLANILHA_ID, Config.ABA_HISTORICO):
+            logger.info("Cache de hashes e de outra planilha/aba de historico, baixando historico")
+            return None
+        if datetime.now() - criado_em > timedelta(days=Config.CACHE_HASHES_VALIDADE_DIAS):
+            return None
+        logger.info(f"Usando cache local de hashes ({len(bloom)} transacoes)")
+        self._bloom_criado_em = criado_em
+        return bloom
+
+    def _salvar_cache_bloom(self, bloom):
+        try:
+            os.makedirs(os.path.dirname(Config.ARQUIVO_CACHE_HASHES), exist_ok=True)
+            with open(Config.ARQUIVO_CACHE_HASHES, 'wb') as f:
+                pickle.dump((Config.PLANILHA_ID, Config.ABA_HISTORICO, self._bloom_criado_em, bloom), f)
+        except Exception as e:
+            logger.warning(f"Nao foi possivel salvar o cache de hashes: {e}")
+
+    def _atualizar_cache_bloom(self, hashes):
+        # Inclui as transacoes recem-importadas no Bloom filter salvo em disco
+        try:
+            for h in hashes:
+                self._hashes_cache.add(h)
+        except IndexError:
+            # Capacidade esgotada: descarta o cache para ser reconstruido na proxima execucao
+            if os.path.exists(Config.ARQUIVO_CACHE_HASHES):
+                os.remove(Config.ARQUIVO_CACHE_HASHES)
+            return
+        self._salvar_cache_bloom(self._hashes_cache)
+
+    def _confirmar_duplicatas(self, df, novas):
+        # O Bloom filter admite falsos positivos: confirma as duplicatas contra a coluna Hash real
+        duplicadas = df[~novas]
+        try:
+            historico = frozenset(self.planilha.worksheet(Config.ABA_HISTORICO).col_values(1)[1:])
+        except Exception as e:
+            logger.warning(f"Nao foi possivel confirmar as duplicatas no historico: {e}")
+            for _, row in duplicadas.iterrows():
+                logger.info(f"Ignorada como duplicata: {row['Data']:%d/%m/%Y} | {row['Descricao']} | {row['Valor']}")
+            return novas
+        
+        legados = self._gerar_hashes(duplicadas, legado=True)
+        falsos_positivos = [h not in historico and l not in historico for h, l in zip(duplicadas['Hash'], legados)]
+        if any(falsos_positivos):
+            logger.info(f"{sum(falsos_positivos)} falso(s) positivo(s) do Bloom filter mantido(s) como transacao nova")
+        novas = novas.copy()
+        novas[~novas] = falsos_positivos
+        return novas
 
     def _criar_aba_historico(self):
         aba = self.planilha.add_worksheet(Config.ABA_HISTORICO, 1000, 10)
         aba.update([['Hash', 'Data', 'Descricao', 'Valor', 'Data_Importacao']], 'A1:E1')
 
     def _encontrar_proxima_linha_vazia(self, coluna, inicio, fim):
-        range_notation = f'{coluna}{inicio}:{coluna}{fim}'
-        valores = self.aba_mes.get(range_notation, value_render_option='UNFORMATTED_VALUE')
-        
-        if not valores: return inicio
-        
-        linha_atual = inicio
-        for linha_valores in valores:
-            if not linha_valores or linha_valores[0] in [None, '']:
-                return linha_atual
-            linha_atual += 1
+        # Consulta o snapshot da aba lido no __init__, sem chamadas a API
+        indice = ord(coluna) - ord('A')
+        for linha in range(inicio, fim + 1):
+            linha_valores = self._aba_snapshot[linha - 1] if linha <= len(self._aba_snapshot) else []
+            if indice >= len(linha_valores) or linha_valores[indice] in [None, '']:
+                return linha
             
         return None # Secao cheia
 
+    def _marcar_celula_snapshot(self, coluna, linha, valor):
+        # Mantem o snapshot coerente com o que foi enviado para a planilha
+        indice = ord(coluna) - ord('A')
+        while len(self._aba_snapshot) < linha:
+            self._aba_snapshot.append([])
+        linha_valores = self._aba_snapshot[linha - 1]
+        linha_valores.extend([''] * (indice + 1 - len(linha_valores)))
+        linha_valores[indice] = valor
+
     def importar_transacoes(self, df):
         logger.info("Iniciando importacao...")
-        df['Hash'] = df.apply(self._gerar_hash_transacao, axis=1)
+        df['Hash'] = self._gerar_hashes(df)
         
         hashes_existentes = self._get_transacoes_existentes()
-        df_novas = df[~df['Hash'].isin(hashes_existentes)]
+        novas = pd.Series([h not in hashes_existentes for h in df['Hash']], index=df.index)
+        if novas.any():
+            # Historico gravado antes do BLAKE3 contem hashes MD5
+            legados = self._gerar_hashes(df[novas], legado=True)
+            novas[novas] = [h not in hashes_existentes for h in legados]
+        if not isinstance(hashes_existentes, frozenset) and not novas.all():
+            novas = self._confirmar_duplicatas(df, novas)
+        # Data fica como datetime64 ate aqui; formata uma unica vez para escrita nas planilhas
+        df_novas = df[novas].assign(Data=lambda d: d['Data'].dt.strftime('%d/%m/%Y'))
         
         if df_novas.empty:
             logger.info("Nenhuma transacao nova.")
@@ -258,40 +505,52 @@ class IntegradorSheets:
 
     def _processar_insercoes(self, df):
         # Wrapper para organizar a chamada das insercoes
-        resultado = df.apply(lambda row: CategorizadorIA.categorizar(row['Descricao'], row['Valor']), axis=1)
-        df['Categoria'] = resultado.apply(lambda x: x[0])
-        df['Tipo'] = resultado.apply(lambda x: x[1])
-        df['EhFixo'] = resultado.apply(lambda x: x[2])
-        df['Forma'] = df['Descricao'].apply(CategorizadorIA.identificar_forma_pagamento)
+        desc = df['Descricao'].str.lower()
+        df['Categoria'], df['Tipo'], df['EhFixo'] = CategorizadorIA.categorizar_lote(df, desc)
+        df['Forma'] = CategorizadorIA.identificar_formas_pagamento(desc)
+        # Descricao normalizada apenas para a aba do mes (o historico mantem o texto completo)
+        descricoes = df['Descricao'].astype(str).str.strip().str.slice(0, 50)
+        # O batch_update usa USER_ENTERED (para a Data virar data): o apostrofo inicial faz o Sheets
+        # guardar como texto descricoes do banco que comecam com = + - @, em vez de formula/numero
+        descricoes = descricoes.mask(descricoes.str.match(r'[=+\-@]'), "'" + descricoes)
+        df = df.assign(Descricao=descricoes)
         
-        self._inserir_entradas(df[df['Tipo'] == 'Receita'])
-        self._inserir_gastos_fixos(df[(df['Tipo'] == 'Despesa') & (df['EhFixo'] == True)])
-        self._inserir_gastos_variaveis(df[(df['Tipo'] == 'Despesa') & (df['EhFixo'] == False)])
+        # As tres secoes (um retangulo cada) sao gravadas juntas em uma unica chamada a API
+        payload = (
+            self._inserir_entradas(df[df['Tipo'] == 'Receita'])
+            + self._inserir_gastos_fixos(df[(df['Tipo'] == 'Despesa') & (df['EhFixo'] == True)])
+            + self._inserir_gastos_variaveis(df[(df['Tipo'] == 'Despesa') & (df['EhFixo'] == False)])
+        )
+        if payload:
+            self.aba_mes.batch_update(payload, value_input_option='USER_ENTERED')
 
-    # --- Metodos auxiliares de insercao (simplificados para visualizacao) ---
-    def _inserir_entradas(self, df): self._inserir_generico(df, Config.ENTRADAS_COL_DESCRICAO, Config.ENTRADAS_INICIO_LINHA, Config.ENTRADAS_FIM_LINHA)
-    def _inserir_gastos_fixos(self, df): self._inserir_generico(df, Config.FIXOS_COL_DESCRICAO, Config.FIXOS_INICIO_LINHA, Config.FIXOS_FIM_LINHA)
-    def _inserir_gastos_variaveis(self, df): self._inserir_generico(df, Config.VARIAVEIS_COL_DESCRICAO, Config.VARIAVEIS_INICIO_LINHA, Config.VARIAVEIS_FIM_LINHA)
+    # --- Metodos auxiliares de insercao (retornam o payload de cada secao) ---
+    def _inserir_entradas(self, df): return self._inserir_generico(df[['Descricao', 'Valor', 'Data']], Config.ENTRADAS_COL_DESCRICAO, Config.ENTRADAS_COL_DATA, Config.ENTRADAS_INICIO_LINHA, Config.ENTRADAS_FIM_LINHA)
+    def _inserir_gastos_fixos(self, df): return self._inserir_generico(df[['Descricao', 'Valor', 'Data', 'Categoria']], Config.FIXOS_COL_DESCRICAO, Config.FIXOS_COL_CATEGORIA, Config.FIXOS_INICIO_LINHA, Config.FIXOS_FIM_LINHA)
+    def _inserir_gastos_variaveis(self, df): return self._inserir_generico(df[['Descricao', 'Valor', 'Data', 'Categoria', 'Forma']], Config.VARIAVEIS_COL_DESCRICAO, Config.VARIAVEIS_COL_FORMA, Config.VARIAVEIS_INICIO_LINHA, Config.VARIAVEIS_FIM_LINHA)
     
-    def _inserir_generico(self, df, col_desc, inicio, fim):
-        # Logica de insercao segura com verificacao de espaco
+    def _inserir_generico(self, df, col_desc, col_fim, inicio, fim):
+        # Logica de insercao segura com verificacao de espaco: a secao vira um unico retangulo de valores
         linha = self._encontrar_proxima_linha_vazia(col_desc, inicio, fim)
-        if linha and linha <= fim:
-            for _, row in df.iterrows():
-                if linha > fim: break
-                # Atualiza celulas (Resumido)
-                self.aba_mes.update([[str(row['Descricao'])[:50]]], f'{col_desc}{linha}')
-                # ... outros campos ...
-                linha += 1
+        if not linha or df.empty:
+            return []
+        
+        valores = df.iloc[:fim - linha + 1].values.tolist()
+        ultima_linha = linha + len(valores) - 1
+        for deslocamento, linha_valores in enumerate(valores):
+            self._marcar_celula_snapshot(col_desc, linha + deslocamento, linha_valores[0])
+        return [{'range': f'{col_desc}{linha}:{col_fim}{ultima_linha}', 'values': valores}]
 
     def _atualizar_historico(self, df):
         try:
-            aba = self.planilha.worksheet(Config.ABA_HISTORICO)
-            valores = aba.get_all_values()
-            prox_linha = len(valores) + 1
-            df['Data_Importacao'] = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-            dados = df[['Hash', 'Data', 'Descricao', 'Valor', 'Data_Importacao']].values.tolist()
-            aba.update(dados, f'A{prox_linha}')
+            data_importacao = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+            dados = [[*linha, data_importacao] for linha in df[['Hash', 'Data', 'Descricao', 'Valor']].values.tolist()]
+            # O append e feito no servidor: dispensa baixar o historico so para achar a ultima linha
+            self.planilha.worksheet(Config.ABA_HISTORICO).append_rows(dados, value_input_option='RAW')
+            if isinstance(self._hashes_cache, frozenset):
+                self._hashes_cache = self._hashes_cache | frozenset(df['Hash'])
+            elif self._hashes_cache is not None:
+                self._atualizar_cache_bloom(df['Hash'])
         except Exception as e:
             logger.error(f"Erro ao salvar historico: {e}")
 
@@ -312,11 +571,10 @@ def main():
         logger.warning("Nenhum CSV encontrado.")
         return
         
-    df_consolidado = pd.DataFrame()
-    for arq in arquivos:
-        try:
-            df_consolidado = pd.concat([df_consolidado, LeitorExtratos.detectar_e_ler(arq)])
-        except: continue
+    # O parse do CSV libera o GIL, entao os arquivos sao lidos em paralelo
+    with ThreadPoolExecutor(max_workers=min(8, len(arquivos))) as executor:
+        frames = [df for df in executor.map(LeitorExtratos.ler_ou_ignorar, arquivos) if df is not None]
+    df_consolidado = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
             
     if not df_consolidado.empty:
         IntegradorSheets().importar_transacoes(df_consolidado)